@@ -1,9 +1,8 @@
-from easydict import EasyDict
 import os
 import sys
 
 # 直接从当前目录导入
-from youtube_channel_videos import YouTubeChannelVideos
+from youtube_channel_videos import YouTubeChannelVideos, _print_result
 
 if __name__ == "__main__":
     # 从环境变量获取API令牌
@@ -21,11 +20,11 @@ if __name__ == "__main__":
     
     # 测试用例1：基本测试
     print("测试用例1：基本测试")
-    config = EasyDict({
+    config = {
         "channel_url": "https://www.youtube.com/@yttalkjun",
         "max_videos": 3,
         "time_filter": 24
-    })
+    }
     
     print("输入配置:")
     for key, value in config.items():
@@ -33,30 +32,13 @@ if __name__ == "__main__":
     
     try:
         output = widget({}, config)
-        print("\n输出结果:")
-        print(f"  获取的视频总数: {output['total_fetched']}")
-        print(f"  时间过滤后的视频数量: {output['filtered_count']}")
-        
-        if output['filtered_count'] > 0:
-            print("\n视频详情:")
-            for i, video in enumerate(output['videos']):
-                print(f"\n视频 #{i+1}:")
-                print(f"  标题: {video.get('title', 'N/A')}")
-                print(f"  URL: {video.get('url', 'N/A')}")
-                print(f"  上传时间: {video.get('date', 'N/A')}")
-                print(f"  观看次数: {video.get('viewCount', 'N/A')}")
-                print(f"  时长: {video.get('duration', 'N/A')}")
-                print(f"  会员专属: {video.get('isMembersOnly', False)}")
-        else:
-            print("\n未找到符合条件的视频")
-            if 'error' in output:
-                print(f"错误: {output['error']}")
+        _print_result(output)
     except Exception as e:
         print(f"测试失败: {str(e)}")
     
     # 测试用例2：不同时间过滤器
     print("\n\n测试用例2：不同时间过滤器")
-    config.time_filter = 1  # 只获取1小时内的视频
+    config["time_filter"] = 1  # 只获取1小时内的视频
     
     print("输入配置:")
     for key, value in config.items():
@@ -64,11 +46,7 @@ if __name__ == "__main__":
     
     try:
         output = widget({}, config)
-        print("\n输出结果:")
-        print(f"  获取的视频总数: {output['total_fetched']}")
-        print(f"  时间过滤后的视频数量: {output['filtered_count']}")
-        if 'error' in output:
-            print(f"错误: {output['error']}")
+        _print_result(output, show_videos=False)
     except Exception as e:
         print(f"测试失败: {str(e)}")
 
@@ -1,109 +1,436 @@
-from pydantic import Field
-from typing import List, Dict, Any
+from pydantic import ConfigDict, Field
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
 from datetime import datetime, timezone, timedelta
-from apify_client import ApifyClient
+from operator import itemgetter
+import asyncio
+import copy
+import functools
+import heapq
+import itertools
 import os
+import re
+import sys
+import threading
+import time
 
 from proconfig.widgets.base import WIDGETS, BaseWidget
 
+# 可选依赖：安装了orjson时用它解析数据集结果，否则使用标准库json
+try:
+    from orjson import loads as _json_loads
+except ImportError:
+    from json import loads as _json_loads
+
+# Python 3.11+ 的 fromisoformat 原生支持末尾的 'Z'，无需预处理
+_PY311 = sys.version_info >= (3, 11)
+
+# 可选依赖：安装了ciso8601时用它解析上传时间（C实现，原生支持末尾的'Z'）
+try:
+    from ciso8601 import parse_datetime as _parse_iso
+except ImportError:
+    if _PY311:
+        _parse_iso = datetime.fromisoformat
+    else:
+        def _parse_iso(date_str):
+            if date_str.endswith('Z'):
+                date_str = date_str[:-1] + '+00:00'
+            return datetime.fromisoformat(date_str)
+
+# 预先校验日期格式（必须带时区，否则无法与带时区的cutoff比较），快速跳过缺失或异常的日期
+_ISO_RE = re.compile(r'^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:\d{2})$')
+
+_ACTOR_ID = "streamers/youtube-scraper"
+
+# 按API令牌缓存Apify客户端和Actor句柄，多次调用间复用连接
+_CLIENT_CACHE: Dict[str, Any] = {}
+_ACTOR_CACHE: Dict[str, Any] = {}
+
+
+@functools.lru_cache(maxsize=None)
+def _lazy_client(use_async=False):
+    # 首次使用时才导入apify_client，避免组件注册时就加载它及其HTTP依赖
+    import apify_client
+    return apify_client.ApifyClientAsync if use_async else apify_client.ApifyClient
+
+
+def _get_apify(api_token):
+    if api_token not in _CLIENT_CACHE:
+        client = _lazy_client()(api_token)
+        _CLIENT_CACHE[api_token] = client
+        _ACTOR_CACHE[api_token] = client.actor(_ACTOR_ID)
+    return _CLIENT_CACHE[api_token], _ACTOR_CACHE[api_token]
+
+
+async def _close_async_client(client):
+    # ApifyClientAsync没有公开的close方法，直接关闭其底层的httpx连接池；
+    # 该属性并非公开接口，客户端升级后不存在时跳过关闭，不影响抓取结果
+    http_client = getattr(getattr(client, "http_client", None), "httpx_async_client", None)
+    if http_client is not None:
+        await http_client.aclose()
+
+
+# 短时间内重复请求同一频道时复用抓取结果: (channel_url, max_videos) -> (抓取时间, 视频列表)
+_RESULT_CACHE_TTL = 60.0
+_RESULT_CACHE: Dict[Tuple[str, int], Tuple[float, List[dict]]] = {}
+# 宿主可能在多个线程中同时调用execute，清理与写入缓存时需要加锁
+_RESULT_CACHE_LOCK = threading.Lock()
+
+
+def _get_cached_videos(cache_key):
+    with _RESULT_CACHE_LOCK:
+        cached = _RESULT_CACHE.get(cache_key)
+    if cached is not None and time.monotonic() - cached[0] < _RESULT_CACHE_TTL:
+        return cached[1]
+    return None
+
+
+def _cache_videos(cache_key, videos):
+    now = time.monotonic()
+    with _RESULT_CACHE_LOCK:
+        # 顺便清理过期条目，避免缓存无限增长
+        for key in [k for k, (ts, _) in _RESULT_CACHE.items() if now - ts >= _RESULT_CACHE_TTL]:
+            del _RESULT_CACHE[key]
+        _RESULT_CACHE[cache_key] = (now, videos)
+
+
+# 会员专属视频通常很少，先只多取少量视频；不够时再按两倍数量重新抓取
+_MEMBERS_SLACK = 2
+
+
+def _initial_max_results(max_videos):
+    return min(max_videos + _MEMBERS_SLACK, max_videos * 2)
+
+
+def _needs_refetch(videos, max_videos, max_results):
+    # 结果被maxResults截断，且排除会员专属视频后不足max_videos个
+    if len(videos) < max_results or max_results >= max_videos * 2:
+        return False
+    # 找到max_videos个非会员、不重复的视频后即停止遍历
+    return len(list(itertools.islice(_public_videos(videos), max_videos))) < max_videos
+
+
+def _wait_secs(scrape_timeout):
+    # 0表示不限制等待时间
+    return scrape_timeout if scrape_timeout > 0 else None
+
+
+# 等待超时后Actor可能仍处于这些状态，需要主动中止以免继续运行计费
+_UNFINISHED_STATUSES = ("READY", "RUNNING")
+
+
+def _is_unfinished(run):
+    return bool(run) and run.get("status") in _UNFINISHED_STATUSES
+
+
+def _check_run(run):
+    # 超时仍在运行或运行失败时，数据集可能不完整，直接报错
+    status = run.get("status") if run else None
+    if status != "SUCCEEDED":
+        raise RuntimeError(f"YouTube抓取任务未成功完成（状态: {status}）")
+    return run
+
+
+def _build_run_input(channel_url, max_results):
+    # 准备Actor输入
+    return {
+        "startUrls": [
+            {
+                "url": channel_url
+            }
+        ],
+        "maxResults": max_results,
+        "maxResultsShorts": 0,
+        "maxResultStreams": 0,
+        "sortVideosBy": "NEWEST"
+    }
+
+
+# 按上传时间排序（ISO时间字符串的字典序即时间顺序）
+_DATE_KEY = itemgetter("date")
+
+
+def _is_duplicate(video, seen_ids):
+    # 抓取结果分页重叠时同一视频可能出现多次；没有id的视频无法判断，视为不重复
+    video_id = video.get("id")
+    if video_id is None:
+        return False
+    if video_id in seen_ids:
+        return True
+    seen_ids.add(video_id)
+    return False
+
+
+def _public_videos(videos):
+    # 移除会员专属视频 (isMembersOnly: true) 及重复视频，筛选与补抓判断共用
+    seen_ids = set()
+    for video in videos:
+        if not video.get("isMembersOnly") and not _is_duplicate(video, seen_ids):
+            yield video
+
+
+def _make_keep(cutoff=None):
+    # 没有上传时间或格式异常的视频无法排序，直接跳过；cutoff非空时只保留其后上传的视频
+    if cutoff is None:
+        # 不做时间过滤时只校验格式，完全跳过日期解析
+        return lambda video: bool(_ISO_RE.match(video.get("date") or ""))
+    _fromiso = _parse_iso
+    
+    def _keep(video):
+        date_str = video.get("date")
+        if not date_str or not _ISO_RE.match(date_str):
+            return False
+        # 格式正确但数值非法（如13月）的日期同样跳过，不影响其他视频
+        try:
+            return _fromiso(date_str) > cutoff
+        except ValueError:
+            return False
+    
+    return _keep
+
+
+def _filter_videos(all_videos, k, cutoff=None):
+    # 单次遍历：按上传时间从新到旧取前k个视频，同时统计参与筛选的非会员视频数
+    counter = itertools.count()
+    # zip先取视频再取计数，视频耗尽时计数器正好停在已遍历的视频数
+    public_videos = (video for video, _ in zip(_public_videos(all_videos), counter))
+    videos = heapq.nlargest(k, filter(_make_keep(cutoff), public_videos), key=_DATE_KEY)
+    return videos, next(counter)
+
+
+class _FetchRequest(NamedTuple):
+    api_token: Optional[str]
+    channel_url: str
+    max_videos: int
+    time_filter: int
+    wait_secs: Optional[int]
+    force_refresh: bool
+
+
+def _parse_request(config):
+    # 使用config.xxx而不是config['xxx']；API密钥从环境变量获取
+    return _FetchRequest(
+        api_token=os.environ.get("APIFY_API_KEY"),
+        channel_url=config.channel_url,
+        max_videos=config.max_videos,
+        time_filter=config.time_filter,
+        wait_secs=_wait_secs(config.scrape_timeout),
+        force_refresh=config.force_refresh_cache,
+    )
+
+
+def _fetch_plan(request):
+    # 抓取流程（缓存、补抓判断）与I/O解耦，同步和异步执行共用：
+    # 每次yield (抓取数量, 等待秒数)，调用方运行Actor后把结果send回来，最终结果作为StopIteration.value返回
+    # 缓存命中时只需重新应用时间过滤（依赖当前时间，不缓存）；强制刷新时仍会更新缓存
+    cache_key = (request.channel_url, request.max_videos)
+    cached = None if request.force_refresh else _get_cached_videos(cache_key)
+    if cached is not None:
+        return cached
+    
+    # scrape_timeout是首次抓取与补抓共用的总等待时间
+    deadline = time.monotonic() + request.wait_secs if request.wait_secs else None
+    
+    max_results = _initial_max_results(request.max_videos)
+    videos = yield max_results, request.wait_secs
+    if _needs_refetch(videos, request.max_videos, max_results):
+        wait_secs = None if deadline is None else int(deadline - time.monotonic())
+        # 剩余时间不足时不再补抓，直接使用首次抓取的结果
+        if wait_secs is None or wait_secs > 0:
+            videos = yield request.max_videos * 2, wait_secs
+    
+    _cache_videos(cache_key, videos)
+    return videos
+
+
+_NO_TOKEN_ERROR = "未提供API令牌，请设置环境变量APIFY_API_KEY"
+
+
+def _empty_output():
+    # 每次返回新的字典，避免调用方修改后影响其他结果
+    return {"videos": [], "filtered_count": 0, "total_fetched": 0}
+
+
+def _error_output(message):
+    output = _empty_output()
+    output["error"] = message
+    return output
+
+
 @WIDGETS.register_module()
 class YouTubeChannelVideos(BaseWidget):
     CATEGORY = "Custom Widgets/YouTube"
     NAME = "YouTube Channel Videos"
     
     class InputsSchema(BaseWidget.InputsSchema):
+        model_config = ConfigDict(frozen=True)
+        
         channel_url: str = Field("https://www.youtube.com/@yttalkjun", description="YouTube频道URL，例如: https://www.youtube.com/@channelname")
         max_videos: int = Field(1, description="要获取的最新视频数量 (1-10)", ge=1, le=10)
         time_filter: int = Field(24, description="只返回多少小时内上传的视频 (0表示不过滤)", ge=0)
+        scrape_timeout: int = Field(0, description="等待抓取完成的最长秒数 (0表示不限制)", ge=0)
+        force_refresh_cache: bool = Field(False, description="忽略最近的抓取缓存，强制重新抓取")
     
     class OutputsSchema(BaseWidget.OutputsSchema):
+        model_config = ConfigDict(frozen=True)
+        
         videos: List[dict] = Field([], description="符合条件的视频列表")
         filtered_count: int = Field(0, description="时间过滤后的视频数量")
         total_fetched: int = Field(0, description="获取的视频总数")
     
     def execute(self, environ, config):
-        # 使用config.xxx而不是config['xxx']
-        channel_url = config.channel_url
-        max_videos = config.max_videos
-        time_filter = config.time_filter
+        request = _parse_request(config)
+        if not request.api_token:
+            return _error_output(_NO_TOKEN_ERROR)
         
-        # 从环境变量获取API密钥
+        try:
+            return self._build_output(self._fetch_videos(request), request)
+        except Exception as e:
+            return _error_output(str(e))
+    
+    async def execute_async(self, environ, config, client=None):
+        # 与execute相同，但使用异步Apify客户端，便于并发抓取多个频道
+        # 未传入client时自行创建，并在结束后关闭其连接池
+        request = _parse_request(config)
+        if not request.api_token:
+            return _error_output(_NO_TOKEN_ERROR)
+        
+        owns_client = client is None
+        if owns_client:
+            client = _lazy_client(use_async=True)(request.api_token)
+        try:
+            return self._build_output(await self._fetch_videos_async(client, request), request)
+        except Exception as e:
+            return _error_output(str(e))
+        finally:
+            if owns_client:
+                await _close_async_client(client)
+    
+    @classmethod
+    async def execute_batch(cls, pairs, max_concurrency=None):
+        # 并发执行多组(environ, config)，总耗时取决于最慢的一次抓取
+        # max_concurrency限制同时运行的Actor数量，避免超出Apify账户的并发及内存限制；None表示不限制
+        if max_concurrency is not None and max_concurrency < 1:
+            raise ValueError(f"max_concurrency必须为正整数或None（当前为{max_concurrency}）")
+        # 整个批次共享一个异步客户端及其连接池，批次结束后关闭
         api_token = os.environ.get("APIFY_API_KEY")
+        client = _lazy_client(use_async=True)(api_token) if api_token else None
+        semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency is not None else None
         
-        if not api_token:
-            return {
-                "videos": [],
-                "filtered_count": 0,
-                "total_fetched": 0,
-                "error": "未提供API令牌，请设置环境变量APIFY_API_KEY"
-            }
+        async def _run(environ, config):
+            # config为字典，与通过框架调用时一样先经InputsSchema校验并补全默认值；
+            # 校验失败只影响该项结果，不影响批次中的其他频道
+            try:
+                config = cls.InputsSchema.model_validate(config)
+            except Exception as e:
+                return _error_output(str(e))
+            if semaphore is None:
+                return await cls().execute_async(environ, config, client)
+            async with semaphore:
+                return await cls().execute_async(environ, config, client)
+        
+        try:
+            return await asyncio.gather(*[_run(environ, config) for environ, config in pairs])
+        finally:
+            if client is not None:
+                await _close_async_client(client)
+    
+    def _build_output(self, all_videos, request):
+        max_videos = request.max_videos
+        time_filter = request.time_filter
+        
+        # 频道没有返回任何视频时直接返回，跳过后续筛选
+        if not all_videos:
+            return _empty_output()
         
-        # 初始化Apify客户端
-        client = ApifyClient(api_token)
-        
-        # 准备Actor输入
-        run_input = {
-            "startUrls": [
-                {
-                    "url": channel_url
-                }
-            ],
-            "maxResults": max_videos * 2,  # 获取更多视频以便在过滤后仍有足够数量
-            "maxResultsShorts": 0,
-            "maxResultStreams": 0,
-            "sortVideosBy": "NEWEST"
+        # time_filter为0时不设cutoff，完全跳过时间相关计算
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=time_filter) if time_filter > 0 else None
+        filtered_videos, public_count = _filter_videos(all_videos, max_videos, cutoff)
+        
+        return {
+            # 视频字典同时保存在结果缓存中，返回深拷贝以免调用方修改（包括嵌套的列表、字典）污染缓存
+            "videos": copy.deepcopy(filtered_videos),
+            "filtered_count": len(filtered_videos),
+            # 排除会员专属视频后参与筛选的视频数量（最多max_videos个）
+            "total_fetched": min(public_count, max_videos)
         }
+    
+    def _fetch_videos(self, request):
+        plan = _fetch_plan(request)
+        try:
+            step = next(plan)
+            while True:
+                step = plan.send(self._run_scraper(request, *step))
+        except StopIteration as stop:
+            return stop.value
+    
+    def _run_scraper(self, request, max_results, wait_secs):
+        # 获取Apify客户端和Actor（按令牌缓存）
+        client, actor = _get_apify(request.api_token)
         
-        # 运行Actor并等待完成
+        # 运行Actor并等待完成，超时仍未结束时中止该次运行
+        run = actor.call(run_input=_build_run_input(request.channel_url, max_results), wait_secs=wait_secs)
+        if _is_unfinished(run):
+            client.run(run["id"]).abort()
+        _check_run(run)
+        
+        # 单次请求取回至多max_results条原始JSON再解析（缓存需要完整列表）
+        return _json_loads(client.dataset(run["defaultDatasetId"]).get_items_as_bytes(item_format="json", limit=max_results))
+    
+    async def _fetch_videos_async(self, client, request):
+        plan = _fetch_plan(request)
         try:
-            run = client.actor("streamers/youtube-scraper").call(run_input=run_input)
-            
-            # 获取结果
-            all_videos = list(client.dataset(run["defaultDatasetId"]).iterate_items())
-            
-            # 移除会员专属视频 (isMembersOnly: true)
-            videos = [v for v in all_videos if not v.get("isMembersOnly", False)]
-            
-            # 按上传时间从新到旧排序
-            videos.sort(key=lambda x: x.get("date", ""), reverse=True)
-            
-            # 限制数量
-            videos = videos[:max_videos]
-            
-            # 应用时间过滤器（如果设置）
-            filtered_videos = videos
-            if time_filter > 0:
-                current_time = datetime.now(timezone.utc)
-                filtered_videos = []
-                
-                for video in videos:
-                    if "date" in video:
-                        video_date_str = video["date"]
-                        video_date = datetime.fromisoformat(video_date_str.replace('Z', '+00:00'))
-                        time_difference = current_time - video_date
-                        
-                        if time_difference < timedelta(hours=time_filter):
-                            filtered_videos.append(video)
-            
-            return {
-                "videos": filtered_videos,
-                "filtered_count": len(filtered_videos),
-                "total_fetched": len(videos)
-            }
-            
-        except Exception as e:
-            return {
-                "videos": [],
-                "filtered_count": 0,
-                "total_fetched": 0,
-                "error": str(e)
-            }
+            step = next(plan)
+            while True:
+                step = plan.send(await self._run_scraper_async(client, request, *step))
+        except StopIteration as stop:
+            return stop.value
+    
+    async def _run_scraper_async(self, client, request, max_results, wait_secs):
+        run = await client.actor(_ACTOR_ID).call(
+            run_input=_build_run_input(request.channel_url, max_results), wait_secs=wait_secs
+        )
+        if _is_unfinished(run):
+            await client.run(run["id"]).abort()
+        _check_run(run)
+        return _json_loads(await client.dataset(run["defaultDatasetId"]).get_items_as_bytes(item_format="json", limit=max_results))
+
+
+# 打印视频详情时展示的字段: (标签, 字段名)
+_DISPLAY_FIELDS = (
+    ("标题", "title"),
+    ("URL", "url"),
+    ("上传时间", "date"),
+    ("观看次数", "viewCount"),
+    ("时长", "duration"),
+)
+
+
+def _print_result(result, show_videos=True):
+    # 打印执行结果，供直接运行本模块及测试脚本复用；先拼接所有行再一次性写出
+    lines = [
+        "\n输出结果:",
+        f"  获取的视频总数: {result['total_fetched']}",
+        f"  时间过滤后的视频数量: {result['filtered_count']}",
+    ]
+    
+    if show_videos:
+        if result['videos']:
+            lines.append("\n视频详情:")
+            for i, video in enumerate(result['videos']):
+                lines.append(f"\n视频 #{i+1}:")
+                lines.extend(f"  {label}: {video.get(key, 'N/A')}" for label, key in _DISPLAY_FIELDS)
+                lines.append(f"  会员专属: {video.get('isMembersOnly', False)}")
+        else:
+            lines.append("\n未找到符合条件的视频")
+    
+    if 'error' in result:
+        lines.append(f"错误: {result['error']}")
+    
+    sys.stdout.write("\n".join(lines) + "\n")
 
 
 # 直接测试代码
 if __name__ == "__main__":
-    import os
-    
     try:
         # 从环境变量获取API令牌
         api_token = os.environ.get("APIFY_API_KEY", "")
@@ -115,46 +442,27 @@ if __name__ == "__main__":
             exit(1)
         
         # 创建配置
-        from easydict import EasyDict
-        config = EasyDict({
+        config = {
             "channel_url": "https://www.youtube.com/@yttalkjun",
             "max_videos": 2,
             "time_filter": 24
-        })
+        }
         
         # 创建widget实例并执行
         widget = YouTubeChannelVideos()
         
         print("正在获取YouTube频道视频...")
-        print(f"频道: {config.channel_url}")
-        print(f"最大视频数: {config.max_videos}")
-        print(f"时间过滤: {config.time_filter}小时")
+        print(f"频道: {config['channel_url']}")
+        print(f"最大视频数: {config['max_videos']}")
+        print(f"时间过滤: {config['time_filter']}小时")
         
         result = widget({}, config)
         
         # 输出结果
-        print("\n结果:")
-        print(f"获取的视频总数: {result['total_fetched']}")
-        print(f"时间过滤后的视频数量: {result['filtered_count']}")
-        
-        # 显示视频信息
-        if result['videos']:
-            print("\n视频信息:")
-            for i, video in enumerate(result['videos']):
-                print(f"\n视频 #{i+1}:")
-                print(f"  标题: {video.get('title', 'N/A')}")
-                print(f"  URL: {video.get('url', 'N/A')}")
-                print(f"  上传时间: {video.get('date', 'N/A')}")
-                print(f"  观看次数: {video.get('viewCount', 'N/A')}")
-                print(f"  时长: {video.get('duration', 'N/A')}")
-                print(f"  会员专属: {video.get('isMembersOnly', False)}")
-        else:
-            print("\n未找到符合条件的视频")
-            if 'error' in result:
-                print(f"错误: {result['error']}")
+        _print_result(result)
     
     except Exception as e:
         print(f"测试失败: {e}")
         
     print("\n注意: 请确保已安装所需依赖:")
-    print("pip install -r custom_widgets/youtube_channel_videos/requirements.txt") 
\ No newline at end of file
+    print("pip install -r custom_widgets/youtube_channel_videos/requirements.txt")